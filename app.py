@@ -1,12 +1,23 @@
+# gevent / psycogreen 必須在其他套件 (尤其是 SQLAlchemy、psycopg2) 之前 patch
+from gevent import monkey
+monkey.patch_all()
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()
+
 import os
 import re
-from flask import Flask, request, abort
+import time
+import gevent
+from functools import lru_cache
+from flask import Flask, g, request, abort
 from flask_sqlalchemy import SQLAlchemy
-from datetime import date, datetime, timedelta
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import lazyload
+from datetime import datetime
 
 # LINE Bot 相關套件
 from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
+from linebot.exceptions import InvalidSignatureError, LineBotApiError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage, QuickReply, QuickReplyButton, MessageAction
 
 app = Flask(__name__)
@@ -15,19 +26,54 @@ app = Flask(__name__)
 # 1. 設定區 (資料庫 + LINE Bot)
 # ==========================================
 
-# 資料庫連線
+# 資料庫連線 (建議使用 Supabase 的 transaction pooler，port 6543)
 connection_string = os.environ.get('DATABASE_URL')
-if connection_string and connection_string.startswith("postgres://"):
-    connection_string = connection_string.replace("postgres://", "postgresql://", 1)
+# 明確指定 psycopg2 driver：psycogreen 只 patch psycopg2，
+# 而新版 SQLAlchemy 的 postgresql:// 預設改用 psycopg (3)
+for prefix in ("postgres://", "postgresql://"):
+    if connection_string and connection_string.startswith(prefix):
+        connection_string = connection_string.replace(prefix, "postgresql+psycopg2://", 1)
 
 line_bot_api = LineBotApi(os.environ.get('LINE_CHANNEL_ACCESS_TOKEN'))
 handler = WebhookHandler(os.environ.get('LINE_CHANNEL_SECRET'))
 
 app.config['SQLALCHEMY_DATABASE_URI'] = connection_string
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# 連線池：gevent worker 會同時跑很多 greenlet
+# pool_size + max_overflow ≥ gunicorn --worker-connections (見 Procfile，目前 30)，每個 greenlet 都拿得到連線
+# (pool_size + max_overflow) × workers × 部署數量 ≤ 資料庫 max_connections
+# pool_timeout 設短一點，真的被搶光時快速失敗，不要把 webhook 卡到 LINE 逾時
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+    'pool_timeout': 5,
+    'pool_pre_ping': True,
+    'pool_recycle': 300,
+}
 
 db = SQLAlchemy(app)
 
+# 星期對照表 (weekday 0 = 週一)
+DAYS_MAP = ("一", "二", "三", "四", "五", "六", "日")
+
+# 近期課程回覆的快取秒數 (課程很少異動，且所有人看到的內容都一樣)
+RECENT_COURSES_TTL = 300
+
+# Email 格式檢查
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+# 身分確認按鈕
+IDENTITY_ACCEPT = frozenset({"是的，我是"})
+IDENTITY_REJECT = frozenset({"我只是路過的"})
+
+# 固定回覆文字
+HELP_TEXT = "指令清單：1.「近期課程」2.「已選課程」3.「我的資料」"
+WELCOME_TEXT = "歡迎！請先輸入「綁定資料」來註冊您的帳號。"
+BIND_COMPLETE = (
+    "🎉 恭喜！綁定完成！\n\n"
+    "您可以輸入指令，開始使用以下功能：1.「近期課程」2.「已選課程」3.「我的資料」"
+)
+
 # ==========================================
 # 2. 資料表模型 (符合實際 PostgreSQL Schema)
 # ==========================================
@@ -42,7 +88,11 @@ class User(db.Model):
     created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, nullable=False)
     
     # 新增關聯，讓 user.enrollments 可用
-    enrollments = db.relationship('Enrollment', backref='user', lazy=True, foreign_keys='Enrollment.user_email', primaryjoin='User.email == Enrollment.user_email')
+    enrollments = db.relationship('Enrollment', back_populates='user', lazy='select', foreign_keys='Enrollment.user_email', primaryjoin='User.email == Enrollment.user_email')
+
+    __table_args__ = (
+        db.Index('uq_users_email_lower', db.func.lower(email), unique=True),  # Email 不分大小寫唯一
+    )
 
 class Course(db.Model):
     __tablename__ = 'courses'
@@ -53,38 +103,124 @@ class Course(db.Model):
     start_time = db.Column(db.Time)
     end_date = db.Column(db.Date)
     created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, nullable=False)
-    enrollments = db.relationship('Enrollment', backref='course', lazy=True)
+    enrollments = db.relationship('Enrollment', back_populates='course', lazy='select')
+
+    __table_args__ = (
+        db.Index('idx_courses_weekday_start', 'weekday', 'start_time'),  # 課表排序用
+        db.Index('idx_courses_end_date', 'end_date'),  # 近期課程篩選用 (btree 含 NULL，可同時服務 >= today 與 IS NULL)
+    )
 
 class Enrollment(db.Model):
     __tablename__ = 'enrollments'
     id = db.Column(db.BigInteger, primary_key=True)
     user_email = db.Column(db.Text, db.ForeignKey('users.email', ondelete='CASCADE', onupdate='CASCADE'))
-    course_id = db.Column(db.BigInteger, db.ForeignKey('courses.id', ondelete='CASCADE'))
+    course_id = db.Column(db.BigInteger, db.ForeignKey('courses.id', ondelete='CASCADE'), index=True)
     created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, nullable=False)
 
+    user = db.relationship('User', back_populates='enrollments', foreign_keys=[user_email], primaryjoin='User.email == Enrollment.user_email')
+    course = db.relationship('Course', back_populates='enrollments')
+
+    __table_args__ = (
+        db.Index('idx_enrollments_user_email_course', 'user_email', 'course_id'),  # 已選課程 JOIN 用
+    )
+
 # ==========================================
-# 3. 輔助函數：發送 Quick Reply
+# 3. 輔助函數：格式化 / 發送 Quick Reply
 # ==========================================
-def send_quick_reply(reply_token, text, button_labels):
+def format_weekday(weekday):
+    """0~6 轉成「一」~「日」，未設定時回傳「待定」"""
+    return DAYS_MAP[weekday] if weekday is not None else "待定"
+
+def format_time(t):
+    """HH:MM 格式，直接組字串，不走 strftime"""
+    return f"{t.hour:02d}:{t.minute:02d}" if t else "待定"
+
+def build_recent_courses_text():
+    """取得「近期課程」的回覆文字，每 RECENT_COURSES_TTL 秒最多查一次資料庫"""
+    return _build_recent_courses_text(int(time.time() // RECENT_COURSES_TTL))
+
+@lru_cache(maxsize=1)
+def _build_recent_courses_text(_ttl_bucket):
+    """組出「近期課程」的回覆文字 (所有人看到的內容都一樣，不需要使用者資料)"""
+    # 「今天」(台灣時間) 交給資料庫算
+    today = db.cast(db.func.timezone('Asia/Taipei', db.func.now()), db.Date)
+
+    courses = Course.query.filter(
+        (Course.end_date >= today) | (Course.end_date == None)
+    ).order_by(Course.weekday, Course.start_time).all()
+
+    if not courses:
+        return "目前沒有即將進行的課程喔！😅"
+
+    parts = ["📋 近期課程一覽：\n----------------------\n"]
+
+    for c in courses:
+        day_str = format_weekday(c.weekday)
+        time_str = format_time(c.start_time)
+        
+        # 顯示課程名稱與時間
+        parts.append(f"🔹{c.course_date} {c.course_name}\n   (週{day_str} {time_str})\n")
+        
+        if c.end_date:
+            parts.append(f"   ~ 報名至 {c.end_date} 截止\n")
+
+    google_cal_link = "https://calendar.google.com/..."
+    parts.append(f"\n📅 查看完整行事曆：\n{google_cal_link}")
+    return "".join(parts)
+
+def reply_message(reply_token, messages):
     """
-    發送帶有 Quick Reply 按鈕的訊息
+    排入要回覆給 LINE 的訊息
+    
+    實際呼叫 LINE API 會在本次 webhook commit 之後，於背景 greenlet 送出，
+    不佔用 webhook 的回應時間 (reply token 約 30 秒內有效)。
+    """
+    g.setdefault('pending_replies', []).append((reply_token, messages))
+
+def _send_reply(reply_token, messages):
+    """背景 greenlet 實際呼叫 LINE API；失敗時寫進 log，不要只留在 gevent hub 的 stderr"""
+    try:
+        line_bot_api.reply_message(reply_token, messages)
+    except LineBotApiError as e:
+        app.logger.exception("LINE reply failed (status=%s, reply_token=%s)", e.status_code, reply_token)
+    except Exception:
+        app.logger.exception("LINE reply failed (reply_token=%s)", reply_token)
+
+def is_email_taken(email, user_id):
+    """Email 是否已被其他使用者使用 (只查 id，不載入整個 User)"""
+    return db.session.query(User.id).filter(
+        db.func.lower(User.email) == email,
+        User.id != user_id
+    ).limit(1).scalar() is not None
+
+def build_quick_reply(button_labels):
+    """
+    建立 Quick Reply 按鈕 (按下後會送出與按鈕相同的文字)
     
     Args:
-        reply_token: LINE reply token
-        text: 要顯示的訊息文字
         button_labels: 按鈕文字列表，例如 ["是的，我是", "我只是路過的"]
     """
-    quick_reply_buttons = [
+    return QuickReply(items=[
         QuickReplyButton(action=MessageAction(label=label, text=label))
         for label in button_labels
-    ]
+    ])
+
+# 固定的按鈕組，模組載入時建一次就好
+IDENTITY_QUICK_REPLY = build_quick_reply(["是的，我是", "我只是路過的"])
+EDIT_QUICK_REPLY = build_quick_reply(["修改姓名", "修改Email", "修改身分", "取消修改"])
+
+def send_quick_reply(reply_token, text, quick_reply):
+    """
+    發送帶有 Quick Reply 按鈕的訊息
     
-    messages = TextSendMessage(
-        text=text,
-        quick_reply=QuickReply(items=quick_reply_buttons)
-    )
+    Args:
+        reply_token: LINE reply token
+        text: 要顯示的訊息文字
+        quick_reply: 預先建好的 QuickReply，例如 IDENTITY_QUICK_REPLY
+    """
+    messages = TextSendMessage(text=text, quick_reply=quick_reply)
     
-    line_bot_api.reply_message(reply_token, messages)
+    reply_message(reply_token, messages)
 
 # ==========================================
 # 4. 健康檢查端點
@@ -108,13 +244,104 @@ def callback():
         abort(400)
     return 'OK'
 
+@app.after_request
+def commit_session(response):
+    # 一個 webhook 內的所有狀態變更在這裡一次 commit，只多一次往返資料庫
+    # (失敗的請求不 commit，交給 Flask-SQLAlchemy 在 teardown 時 rollback)
+    if response.status_code < 400:
+        db.session.commit()
+        # 資料已寫入，再到背景送出回覆
+        for reply_token, messages in g.pop('pending_replies', ()):
+            gevent.spawn(_send_reply, reply_token, messages)
+    return response
+
+# ==========================================
+# 6. 功能指令 (已完成綁定的使用者)
+# ==========================================
+# 每個指令接收 (event, user)，回傳要回覆的文字；
+# 若已自行回覆 (例如 Quick Reply) 則回傳 None
+
+# --- 我的資料 ---
+def handle_me(event, user):
+    return (
+        f"您的綁定資料：\n\n"
+        f"姓名: {user.name or '未設定'}\n"
+        f"Email: {user.email}\n"
+        f"身分: {user.identity or '未設定'}\n\n"
+        f"若要修改資料，請輸入「修改資料」，並點選想要修改的資料。"
+    )
+
+# --- 修改資料 ---
+def handle_edit(event, user):
+    user.status = 'edit_select'
+    send_quick_reply(
+        event.reply_token,
+        "請選擇您要修改的項目：",
+        EDIT_QUICK_REPLY
+    )
+    return None
+
+# --- 已選課程 ---
+# 依星期分組，每組回傳第一堂課的日期與已排好格式的課程行，格式化交給資料庫
+MY_COURSES_SQL = db.text("""
+    SELECT c.weekday,
+           (array_agg(c.course_date ORDER BY c.start_time NULLS LAST))[1] AS first_date,
+           string_agg(
+               '   ' || coalesce(to_char(c.start_time, 'HH24:MI'), '待定') || ' ' || c.course_name,
+               E'\\n' ORDER BY c.start_time NULLS LAST
+           ) AS lines
+    FROM enrollments e
+    JOIN courses c ON c.id = e.course_id
+    WHERE e.user_email = :email
+    GROUP BY c.weekday
+    ORDER BY c.weekday NULLS LAST
+""")
+
+def handle_my_courses(event, user):
+    rows = db.session.execute(MY_COURSES_SQL, {"email": user.email}).all()
+    
+    if not rows:
+        return "您目前還沒有選修任何課程喔！📚"
+
+    parts = ["🗓️ 您的課表：\n"]
+    parts.extend(
+        f"\n {first_date}【週{format_weekday(weekday)}】\n{lines}\n"
+        for weekday, first_date, lines in rows
+    )
+    return "".join(parts)
+
+# --- 幫助 ---
+def handle_help(event, user):
+    return HELP_TEXT
+
+# --- 其他未知指令 ---
+def handle_fallback(event, user):
+    return "您可以輸入「幫助」查看可使用的指令哦！"
+
+# 指令對照表 (「近期課程」不需要使用者資料，在 handle_message 最前面就處理掉)
+COMMANDS = {
+    "已選課程": handle_my_courses,
+    "我的資料": handle_me,
+    "修改資料": handle_edit,
+    "幫助": handle_help,
+}
+
 # ==========================================
-# 6. 訊息處理邏輯 (狀態機)
+# 7. 訊息處理邏輯 (狀態機)
 # ==========================================
 @handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
     msg = event.message.text.strip()
     line_id = event.source.user_id
+
+    # --- 近期課程 (所有人都可以查看) ---
+    # 不需要使用者資料，在查詢使用者之前就處理掉，省下一次查詢
+    if msg == "近期課程":
+        reply_message(
+            event.reply_token,
+            TextSendMessage(text=build_recent_courses_text())
+        )
+        return
     
     # 查詢使用者
     user = User.query.filter_by(line_user_id=line_id).first()
@@ -128,27 +355,29 @@ def handle_message(event):
         if user and user.email and "@" in user.email and not user.email.endswith("@temp"):
             # 已經綁定過了
             reply_text = "您已經綁定過了喔！若要修改資料請輸入「修改資料」。"
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+            reply_message(event.reply_token, TextSendMessage(text=reply_text))
         else:
             # 還沒綁定，開始綁定流程
-            if not user:
-                # 建立新使用者，暫時用假 Email
-                user = User(
-                    line_user_id=line_id, 
-                    email=f"{line_id}@temp", 
-                    status='check_identity'
-                )
-                db.session.add(user)
-            else:
-                user.status = 'check_identity'
-            
-            db.session.commit()
+            # 用一條 UPSERT 完成「不存在就建立 (暫時用假 Email)、存在就改狀態」
+            stmt = insert(User).values(
+                line_user_id=line_id,
+                email=f"{line_id}@temp",
+                status='check_identity'
+            ).on_conflict_do_update(
+                index_elements=['line_user_id'],
+                set_={'status': 'check_identity'}
+            ).returning(User).options(
+                lazyload('*')  # 只要 RETURNING 這一條，不要因為 populate_existing 觸發其他 loader
+            )
+            user = db.session.execute(
+                stmt, execution_options={'populate_existing': True}
+            ).scalar_one()
 
             # 發送 Quick Reply 按鈕
             send_quick_reply(
                 event.reply_token,
                 "👋 歡迎使用！請問您是否為「護理相關人員」或「本計畫學員」？",
-                ["是的，我是", "我只是路過的"]
+                IDENTITY_QUICK_REPLY
             )
         return  # 結束這次回應
 
@@ -158,15 +387,13 @@ def handle_message(event):
     
     # --- 狀態 1: 檢查身分階段 ---
     if user and user.status == 'check_identity':
-        if msg == "是的，我是":
+        if msg in IDENTITY_ACCEPT:
             user.status = 'wait_email'  # 通過驗證，下一步問 Email
-            db.session.commit()
             reply_text = "太好了！🎉\n\n接下來請輸入您的 「Email」 以進行綁定：\n(我們將會寄送課程資訊給您)"
         
-        elif msg == "我只是路過的":
+        elif msg in IDENTITY_REJECT:
             # 重置狀態，刪除暫存使用者
             db.session.delete(user) 
-            db.session.commit()
             reply_text = "沒問題！您依舊可以透過「近期課程」指令了解最新課程資訊哦。😊"
         
         else:
@@ -174,21 +401,20 @@ def handle_message(event):
             send_quick_reply(
                 event.reply_token,
                 "請點選下方的按鈕來確認您的身分喔！👇",
-                ["是的，我是", "我只是路過的"]
+                IDENTITY_QUICK_REPLY
             )
             return
 
     # --- 狀態 2: 等待 Email 階段 ---
     elif user and user.status == 'wait_email':
-        if "@" in msg and "." in msg:
+        if EMAIL_RE.match(msg):
+            email = msg.lower()  # Email 一律存小寫
             # 檢查 Email 是否重複
-            check_email = User.query.filter_by(email=msg).first()
-            if check_email and check_email.id != user.id:
+            if is_email_taken(email, user.id):
                 reply_text = "這個 Email 已經有人使用囉！請換一個。"
             else:
-                user.email = msg  # 更新真正的 Email
+                user.email = email  # 更新真正的 Email
                 user.status = 'wait_name'
-                db.session.commit()
                 reply_text = "收到！📧\n接下來，請輸入您於報名系統填入的 「真實姓名」："
         else:
             reply_text = "Email 格式看起來不太對喔，請再檢查一下"
@@ -197,18 +423,13 @@ def handle_message(event):
     elif user and user.status == 'wait_name':
         user.name = msg
         user.status = 'wait_dept'
-        db.session.commit()
         reply_text = f"你好，{msg}！\n最後一步，請輸入您的 「服務單位」 或 「科系」："
 
     # --- 狀態 4: 等待科系/單位階段 ---
     elif user and user.status == 'wait_dept':
         user.identity = msg
         user.status = 'free'  # 綁定完成，狀態自由
-        db.session.commit()
-        reply_text = (
-            "🎉 恭喜！綁定完成！\n\n"
-            "您可以輸入指令，開始使用以下功能：1.「近期課程」2.「已選課程」3.「我的資料」"
-        )
+        reply_text = BIND_COMPLETE
 
     # ==========================================
     # 修改資料流程
@@ -218,29 +439,25 @@ def handle_message(event):
     elif user and user.status == 'edit_select':
         if msg == "修改姓名":
             user.status = 'edit_name'
-            db.session.commit()
             reply_text = f"您目前的姓名是：{user.name or '未設定'}\n\n請輸入新的姓名："
         
         elif msg == "修改Email":
             user.status = 'edit_email'
-            db.session.commit()
             reply_text = f"您目前的 Email 是：{user.email}\n\n請輸入新的 Email："
         
         elif msg == "修改身分":
             user.status = 'edit_identity'
-            db.session.commit()
             reply_text = f"您目前的身分是：{user.identity or '未設定'}\n\n請輸入新的服務單位或科系："
         
         elif msg == "取消修改":
             user.status = 'free'
-            db.session.commit()
             reply_text = "已取消修改。"
         
         else:
             send_quick_reply(
                 event.reply_token,
                 "請點選下方的按鈕來選擇要修改的項目：",
-                ["修改姓名", "修改Email", "修改身分", "取消修改"]
+                EDIT_QUICK_REPLY
             )
             return
     
@@ -249,22 +466,20 @@ def handle_message(event):
         old_name = user.name
         user.name = msg
         user.status = 'free'
-        db.session.commit()
         reply_text = f"✅ 姓名已更新！\n\n舊姓名: {old_name or '未設定'}\n新姓名: {msg}"
     
     # --- 狀態 7: 修改 Email ---
     elif user and user.status == 'edit_email':
-        if "@" in msg and "." in msg:
+        if EMAIL_RE.match(msg):
+            email = msg.lower()  # Email 一律存小寫
             # 檢查新 Email 是否已被其他人使用
-            check_email = User.query.filter_by(email=msg).first()
-            if check_email and check_email.id != user.id:
+            if is_email_taken(email, user.id):
                 reply_text = "這個 Email 已經有人使用囉！請換一個。"
             else:
                 old_email = user.email
-                user.email = msg
+                user.email = email
                 user.status = 'free'
-                db.session.commit()
-                reply_text = f"✅ Email 已更新！\n\n舊 Email: {old_email}\n新 Email: {msg}\n\n⚠️ 注意：您的選課紀錄已自動同步至新 Email。"
+                reply_text = f"✅ Email 已更新！\n\n舊 Email: {old_email}\n新 Email: {email}\n\n⚠️ 注意：您的選課紀錄已自動同步至新 Email。"
         else:
             reply_text = "Email 格式看起來不太對喔，請再檢查一下。"
     
@@ -273,101 +488,25 @@ def handle_message(event):
         old_identity = user.identity
         user.identity = msg
         user.status = 'free'
-        db.session.commit()
         reply_text = f"✅ 身分已更新！\n\n舊身分: {old_identity or '未設定'}\n新身分: {msg}"
 
     # ==========================================
     # 第三層：功能指令 (已完成綁定的使用者)
     # ==========================================
     
-    # --- 近期課程 (所有人都可以查看) ---
-    elif msg == "近期課程":
-        today = (datetime.utcnow() + timedelta(hours=8)).date()
-
-        courses = Course.query.filter(
-            (Course.end_date >= today) | (Course.end_date == None)
-        ).order_by(Course.weekday, Course.start_time).all()
-
-        if not courses:
-            reply_text = "目前沒有即將進行的課程喔！😅"
-        else:
-            reply_text = "📋 近期課程一覽：\n----------------------\n"
-            days_map = ["一", "二", "三", "四", "五", "六", "日"]
-            
-            for c in courses:
-                day_str = days_map[c.weekday] if c.weekday is not None else "待定"
-                time_str = c.start_time.strftime('%H:%M') if c.start_time else "待定"
-                
-                # 顯示課程名稱與時間
-                reply_text += f"🔹{c.course_date} {c.course_name}\n   (週{day_str} {time_str})\n"
-                
-                if c.end_date:
-                    reply_text += f"   ~ 報名至 {c.end_date} 截止\n"
-
-            google_cal_link = "https://calendar.google.com/..."
-            reply_text += f"\n📅 查看完整行事曆：\n{google_cal_link}"
-
     # --- 預設情況: 其他訊息 ---
     else:
         if not user:
-            reply_text = "歡迎！請先輸入「綁定資料」來註冊您的帳號。"
-
-        # --- 我的資料 ---
-        elif msg == "我的資料":
-            reply_text = (
-                f"您的綁定資料：\n\n"
-                f"姓名: {user.name or '未設定'}\n"
-                f"Email: {user.email}\n"
-                f"身分: {user.identity or '未設定'}\n\n"
-                f"若要修改資料，請輸入「修改資料」，並點選想要修改的資料。"
-            )
-        
-        # --- 修改資料 ---
-        elif msg == "修改資料":
-            user.status = 'edit_select'
-            db.session.commit()
-            send_quick_reply(
-                event.reply_token,
-                "請選擇您要修改的項目：",
-                ["修改姓名", "修改Email", "修改身分", "取消修改"]
-            )
-            return
+            reply_text = WELCOME_TEXT
 
-        # --- 已選課程 ---
-        elif msg == "已選課程":
-            enrollments = Enrollment.query.filter_by(user_email=user.email).all()
-            
-            if not enrollments:
-                reply_text = "您目前還沒有選修任何課程喔！📚"
-            else:
-                all_courses = [e.course for e in enrollments]
-                all_courses.sort(key=lambda x: (x.weekday or 999, x.start_time or datetime.min.time()))
-
-                days_map = ["一", "二", "三", "四", "五", "六", "日"]
-                reply_text = "🗓️ 您的課表：\n"
-                
-                current_weekday_index = -1 
-                
-                for c in all_courses:
-                    # 如果換了一天，就印出分隔線和星期幾
-                    if c.weekday != current_weekday_index:
-                        weekday_str = days_map[c.weekday] if c.weekday is not None else "待定"
-                        reply_text += f"\n {c.course_date}【週{weekday_str}】\n"
-                        current_weekday_index = c.weekday
-                    
-                    time_str = c.start_time.strftime('%H:%M') if c.start_time else "待定"
-                    reply_text += f"   {time_str} {c.course_name}\n"
-                    
-        # --- 幫助 ---
-        elif msg == "幫助":
-            reply_text = "指令清單：1.「近期課程」2.「已選課程」3.「我的資料」"
-        
-        # --- 其他未知指令 ---
+        # --- 功能指令 (見 COMMANDS) ---
         else:
-            reply_text = "您可以輸入「幫助」查看可使用的指令哦！"
+            reply_text = COMMANDS.get(msg, handle_fallback)(event, user)
+            if reply_text is None:
+                return  # 指令已自行回覆 (Quick Reply)
 
     # 回傳訊息
-    line_bot_api.reply_message(
+    reply_message(
         event.reply_token,
         TextSendMessage(text=reply_text)
     )
@@ -0,0 +1,3 @@
+-- 「已選課程」：依 (weekday, start_time) 排序課程
+-- (enrollments.user_email 的索引見 0003 的複合索引)
+CREATE INDEX IF NOT EXISTS idx_courses_weekday_start ON courses (weekday, start_time);
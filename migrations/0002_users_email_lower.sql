@@ -0,0 +1,3 @@
+-- Email 不分大小寫唯一：先把既有資料轉小寫 (enrollments.user_email 會跟著 ON UPDATE CASCADE)
+UPDATE users SET email = lower(email) WHERE email <> lower(email);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_users_email_lower ON users (lower(email));
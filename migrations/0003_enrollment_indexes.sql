@@ -0,0 +1,10 @@
+-- 「已選課程」：user_email 篩選後直接帶出 course_id 做 JOIN
+CREATE INDEX IF NOT EXISTS idx_enrollments_user_email_course ON enrollments (user_email, course_id);
+-- 也涵蓋 user_email 單欄查詢，不需要另建單欄索引
+
+-- 外鍵反查 (刪除課程時的 ON DELETE CASCADE、course.enrollments)
+CREATE INDEX IF NOT EXISTS ix_enrollments_course_id ON enrollments (course_id);
+
+-- 「近期課程」：end_date >= today OR end_date IS NULL
+-- 一般 btree 會索引 NULL，兩個條件都能用這個索引 (BitmapOr)；partial index 無法涵蓋 IS NULL 那一側
+CREATE INDEX IF NOT EXISTS idx_courses_end_date ON courses (end_date);